@@ -1,27 +1,45 @@
 
 # sales_agent_new.py
 import os
+import re
+import asyncio
+from typing import Annotated, TypedDict
 from dotenv import load_dotenv
-from langchain_groq import ChatGroq
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
-from langchain.tools import tool
-from langgraph.graph import StateGraph, START, END
-from langgraph.prebuilt import ToolNode
-from langgraph.checkpoint.memory import MemorySaver
-from langmem.short_term import SummarizationNode
-from langchain_core.messages.utils import count_tokens_approximately
-import uuid, json
-from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
+import uuid
+from langchain_core.messages import HumanMessage, AIMessage, ToolMessage, RemoveMessage
 
-from tools.product_tools import tools  # your existing product tools
+# langchain_groq, langgraph and the product tools (pandas) are imported lazily in
+# get_llm() / build_agent() so importing this module stays cheap for the UI.
 
 # Load key
 load_dotenv()
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
-# Initialize model
-llm = ChatGroq(api_key=GROQ_API_KEY, model="llama-3.1-8b-instant")
-model_with_tools = llm.bind_tools(tools)
+_llm = None
+_model_with_tools = None
+_agent = None
+
+
+def get_llm():
+    """Chat model, created on first use."""
+    global _llm
+    if _llm is None:
+        from langchain_groq import ChatGroq
+
+        # bound each call so a slow or failing request can't stall a turn for long
+        _llm = ChatGroq(api_key=GROQ_API_KEY, model="llama-3.1-8b-instant", timeout=10, max_retries=1)
+    return _llm
+
+
+def get_model_with_tools():
+    """Chat model bound to the product tools, created on first use."""
+    global _model_with_tools
+    if _model_with_tools is None:
+        from tools.product_tools import tools
+
+        _model_with_tools = get_llm().bind_tools(tools)
+    return _model_with_tools
 
 
 # -------------------------------------------------------------------
@@ -31,103 +49,306 @@ SYSTEM = SystemMessage(content="""
 You are a concise, professional AI sales agent for an online product catalog. Only use the provided product tools for any product data or actions — do not invent products, details, or prices. Never ask the user for the CSV (it already exists).
 
 Tool contract (use these EXACT tool names/signatures):
-- filter_products_json(product_type: Optional[str], min_rating: Optional[float], min_price: Optional[float], max_price: Optional[float], top_n: int) -> JSON
-  - Returns a JSON object with keys: success, count, recommendations (list of product dicts with product_id, product_name, price, rating, inventory_count, type, product_description).
-  - Use this to produce the Top-5 recommendations.
+- filter_products(product_type: Optional[str], min_rating: Optional[float], min_price: Optional[float], max_price: Optional[float], top_n: int) -> text
+  - Returns the top recommendations already formatted for the user (product_id, product_name, price, rating, type, inventory). It is shown to the user directly as your reply.
+
+- search_product_by_name(product_name: str, top_n: int = 5) -> text
+  - Returns up to top_n matching products already formatted for the user. It is shown to the user directly as your reply.
 
-- check_inventory_json(product_id: str) -> JSON
-  - Returns JSON with success and in_stock (boolean) and inventory_count.
+- check_inventory(product_id: str) -> text
+  - Returns whether the product is in stock, with units available, price, and rating.
 
-- checkout_product_json(product_id: str, quantity: int = 1) -> JSON
-  - Returns JSON with success and order info (order_id, product_id, qty, total_price).
+- checkout_product(product_id: str, quantity: int = 1) -> text
+  - Places the order and returns the order confirmation.
+
+- confirm_and_checkout_json(product_id: str, quantity: int = 1) -> JSON
+  - Re-checks stock and places the order in a single call. Returns JSON with success, in_stock, and order info or error.
 
 Hard behavior rules (follow exactly):
-1. When user asks to buy or browse, call `filter_products_json(...)` to fetch recommendations (top_n <= 5). Infer parameters from the user's request (product type, min_rating, price range). If any required info is missing, ask exactly one concise clarifying question for that specific missing field. Repeat probing only as needed until required info is collected.
-2. After receiving `filter_products_json`, present the Top-N recommendations (N <= 5) as a numbered list showing `product_id`, `product_name`, `price`, and `rating`. Ask the user to select by `product_id` or number.
-3. **Do NOT call** `checkout_product_json` automatically. When a user selects a product (by id or number), you MUST call `check_inventory_json(product_id)` first and then **ask the user** for explicit confirmation to checkout. The explicit confirmation must be an affirmative token such as "yes", "confirm", or "checkout now". Only after the user explicitly confirms should you call `checkout_product_json(product_id, quantity)`. If out of stock, inform the user and offer an alternative from the last recommendations.
+1. When user asks to buy or browse, call `filter_products(...)` to fetch recommendations (top_n <= 5). Infer parameters from the user's request (product type, min_rating, price range). If any required info is missing, ask exactly one concise clarifying question for that specific missing field. Repeat probing only as needed until required info is collected.
+2. The `filter_products` output is shown to the user as-is, followed by a request to select by `product_id` or number; you do not need to restate it.
+3. **Do NOT call** `checkout_product` or `confirm_and_checkout_json` automatically. When a user selects a product (by id or number), you MUST call `check_inventory(product_id)` first and then **ask the user** for explicit confirmation to checkout. The explicit confirmation must be an affirmative token such as "yes", "confirm", or "checkout now". Only after the user explicitly confirms should you call `confirm_and_checkout_json(product_id, quantity)` — it re-checks inventory and checks out in one step, so do NOT call `check_inventory` or `checkout_product` again at that point. If out of stock, inform the user and offer an alternative from the last recommendations.
 4. Never return raw JSON to the user. Use JSON only for internal logic; format human-readable replies.
 5. If the user gives a vague purchase command (e.g., "Buy one of these"), resolve it using the most recent recommendations and if needed ask a single clarifying question: “Which product_id or number would you like?”.
 6. Keep replies short, actionable, and tool-driven. Always follow tool outputs — do not hallucinate inventory, price, or product details.
 7. STATE & MEMORY: When composing responses, prefer using only the **last 10** user/assistant exchanges to decide actions and prompts. Do not rely on older exchanges unless the user explicitly references them.
 
-If you understand, proceed: if the user's initial request lacks required filters (type, rating, price range), ask a single concise clarifying question. Otherwise call `filter_products_json` with inferred or default values (default: top_n=5).
+If you understand, proceed: if the user's initial request lacks required filters (type, rating, price range), ask a single concise clarifying question. Otherwise call `filter_products` with inferred or default values (default: top_n=5).
 """)
 
 
 # -------------------------------------------------------------------
-# MEMORY (from LangGraph docs)
+# MEMORY — heuristic bounded buffer (no extra LLM call per turn)
 # -------------------------------------------------------------------
-summ_model = llm.bind(max_tokens=128)
-summarization_node = SummarizationNode(
-    token_counter=count_tokens_approximately,
-    model=summ_model,
-    max_tokens=256,
-    max_tokens_before_summary=256,
-    max_summary_tokens=128,
-)
+RECENT_WINDOW = 10     # messages passed verbatim to the LLM
+MAX_WINDOW_TOKENS = 2000  # ...as long as they fit in this many approximate tokens
+SUMMARY_TRIGGER = 20   # trim the stored history to summary + window once it grows past this
+MAX_LLM_STEPS = 6      # llm_call -> tools loops allowed per user turn
+
+
+def _approx_tokens(msgs: list) -> int:
+    """Rough token count (chars / 4) — cheap enough to run on every step."""
+    return sum(len(str(m.content)) for m in msgs) >> 2
+
+
+def _recent(msgs: list) -> list:
+    """
+    Last RECENT_WINDOW messages, dropped from the front until they fit MAX_WINDOW_TOKENS,
+    without leading tool results whose tool call was cut off.
+    """
+    recent = msgs[-RECENT_WINDOW:]
+    anchors = [i for i, m in enumerate(recent) if not isinstance(m, ToolMessage)]
+    if not anchors:
+        return []
+    # the newest human/AI message and the tool results answering it always stay
+    keep_from = anchors[-1]
+    start = 0
+    while start < keep_from and (
+        isinstance(recent[start], ToolMessage) or _approx_tokens(recent[start:]) > MAX_WINDOW_TOKENS
+    ):
+        start += 1
+    return recent[start:]
+
+
+def _tool_reply_names(m) -> list:
+    """Tools whose output a tool_reply message repeats ([] for any other message)."""
+    if not isinstance(m, AIMessage):
+        return []
+    return (m.response_metadata or {}).get("tool_reply") or []
+
+
+def _drop_repeated_tool_calls(msgs: list) -> list:
+    """Drop tool calls and results that a following tool_reply message already repeats verbatim."""
+    out = []
+    for m in msgs:
+        if _tool_reply_names(m):
+            while out and isinstance(out[-1], ToolMessage):
+                out.pop()
+            if out and isinstance(out[-1], AIMessage) and out[-1].tool_calls:
+                out.pop()
+        out.append(m)
+    return out
+
+
+def _split_history(msgs: list) -> tuple:
+    """Split stored messages into (head summary or [], older messages outside the window, recent window)."""
+    head = msgs[:1] if msgs and isinstance(msgs[0], SystemMessage) else []
+    # a direct reply holds the same product list as its ToolMessage; count and send it once
+    body = _drop_repeated_tool_calls(msgs[len(head):])
+    recent = _recent(body)
+    return head, body[:len(body) - len(recent)], recent
+
+
+SUMMARY_PREFIX = "[Earlier conversation: "
+
+
+def _clean(text: str) -> str:
+    """Keep summary field separators out of quoted message text."""
+    return " ".join(str(text).split()).replace("|", "/").replace(";", ",")
+
+
+def _parse_summary(msg: SystemMessage) -> dict:
+    """Fields of a summary produced by _heuristic_summary (empty for any other SystemMessage)."""
+    text = str(msg.content)
+    if not (text.startswith(SUMMARY_PREFIX) and text.endswith("]")):
+        return {}
+    fields = {}
+    for part in text[len(SUMMARY_PREFIX):-1].split(" | "):
+        key, sep, value = part.partition(": ")
+        if sep:
+            fields[key] = value
+    return fields
+
+
+def _heuristic_summary(older: list) -> SystemMessage:
+    """Condense older messages into one SystemMessage by plain string inspection, folding in any earlier summary."""
+    previous = {}
+    for m in older:
+        if isinstance(m, SystemMessage):
+            previous = _parse_summary(m) or previous
+
+    asks = [a for a in previous.get("user asked about", "").split("; ") if a]
+    asks += [_clean(m.content)[:80] for m in older if isinstance(m, HumanMessage) and str(m.content).strip()]
+    tool_names = [t for t in previous.get("tools used", "").split(", ") if t]
+    for m in older:
+        if isinstance(m, AIMessage):
+            tool_names += [tc["name"] for tc in (m.tool_calls or [])] + _tool_reply_names(m)
+    product_ids = []
+    for m in reversed(older):
+        if isinstance(m, ToolMessage) or _tool_reply_names(m):
+            product_ids = re.findall(r"^• (\S+) —", str(m.content), flags=re.MULTILINE)
+            if product_ids:
+                break
+    products = ",".join(product_ids) or previous.get("recommended products", "")
+    # the newest assistant reply decides whether a confirmation is still pending
+    last_ai = next((m for m in reversed(older) if isinstance(m, AIMessage) and m.content), None)
+    if last_ai is None:
+        pending = previous.get("pending", "")
+    elif "confirm" in str(last_ai.content).lower():
+        pending = _clean(last_ai.content)[:120]
+    else:
+        pending = ""
 
-memory = MemorySaver()
+    parts = []
+    if asks:
+        parts.append("user asked about: " + "; ".join(asks[-3:]))
+    if tool_names:
+        parts.append("tools used: " + ", ".join(dict.fromkeys(tool_names)))
+    if products:
+        parts.append("recommended products: " + products)
+    if pending:
+        parts.append("pending: " + pending)
+    return SystemMessage(content=SUMMARY_PREFIX + " | ".join(parts) + "]")
+
+
+def summarize(state: dict):
+    """Prepare the LLM context: recent messages, prefixed by a heuristic summary once history is long."""
+    head, older, recent = _split_history(state.get("messages") or [])
+    if not older:
+        # a summary persisted by an earlier trim sits at the head of the history; keep it in context
+        return {"summarized_messages": head + recent}
+    return {"summarized_messages": [_heuristic_summary(head + older)] + recent}
 
 
 # -------------------------------------------------------------------
 # LLM node — limit messages used to the last 10 exchanges
 # -------------------------------------------------------------------
-def llm_call(state: dict):
-    """Model decides next step — use only last 10 exchanges when calling the LLM"""
-    # state["messages"] is a list of Message objects; keep only last 10 entries
-    msgs = state.get("summarized_messages") or state.get("messages") or []
-    # limit to last 10 message objects for context (preserves ordering)
-    msgs = msgs[-10:]
-    return {
-        "messages": [
-            llm.invoke([SYSTEM] + msgs)
-        ]
-    }
+async def llm_call(state: dict):
+    """Model decides next step — use only last 10 exchanges (plus summary) when calling the LLM"""
+    # summarized_messages is already bounded by the summarize node
+    context = state.get("summarized_messages") or _split_history(state.get("messages") or [])[2]
+    step = state.get("step_count", 0) + 1
+    # on the last allowed step, call the model without tools so the turn ends with a text reply
+    model = get_model_with_tools() if step < MAX_LLM_STEPS else get_llm()
+    response = await model.ainvoke([SYSTEM] + context)
+
+    history = state.get("messages") or []
+    if len(history) > SUMMARY_TRIGGER:
+        # persist only summary + recent window so the checkpoint doesn't grow with the conversation
+        head, older, recent = _split_history(history)
+        summary = context[0] if isinstance(context[0], SystemMessage) else _heuristic_summary(head + older)
+        from langgraph.graph.message import REMOVE_ALL_MESSAGES
+
+        return {
+            "messages": [RemoveMessage(id=REMOVE_ALL_MESSAGES), summary, *recent, response],
+            "step_count": step,
+        }
+    return {"messages": [response], "step_count": step}
 
 
 # -------------------------------------------------------------------
 # ROUTE logic — check if model called a tool
 # -------------------------------------------------------------------
 def route(state):
+    from langgraph.graph import END
+
+    if state.get("step_count", 0) >= MAX_LLM_STEPS:
+        return END
     last = state["messages"][-1]
     return "tools" if getattr(last, "tool_calls", None) else END
 
 
+# -------------------------------------------------------------------
+# DIRECT REPLY — tools whose output is already user-ready skip the second LLM call
+# -------------------------------------------------------------------
+DIRECT_REPLY_TOOLS = {"filter_products", "search_product_by_name"}
+
+
+def _last_tool_results(msgs: list) -> list:
+    """ToolMessages produced by the most recent tools step (the trailing run of ToolMessages)."""
+    results = []
+    for m in reversed(msgs):
+        if not isinstance(m, ToolMessage):
+            break
+        results.append(m)
+    return results[::-1]
+
+
+def _lists_products(m: ToolMessage) -> bool:
+    return m.name in DIRECT_REPLY_TOOLS and m.status != "error" and "•" in str(m.content)
+
+
+def route_after_tools(state):
+    results = _last_tool_results(state["messages"])
+    if results and all(_lists_products(m) for m in results):
+        return "tool_reply"
+    # e.g. check_inventory, a failed call or no matches: the model still has to ask for
+    # confirmation, fix its arguments, or offer alternatives
+    return "summarize"
+
+
+def tool_reply(state: dict):
+    """Use the formatted tool output as the final reply instead of asking the LLM to restate it."""
+    results = _last_tool_results(state["messages"])
+    text = "\n\n".join(str(m.content) for m in results)
+    # prompt for a selection like the LLM would
+    text += "\n\nWhich product_id or number would you like?"
+    # the metadata lets the memory code drop the tool call this reply repeats
+    return {"messages": [AIMessage(content=text, response_metadata={"tool_reply": [m.name for m in results]})]}
+
+
 # -------------------------------------------------------------------
 # Build simple graph (same as docs)
 # -------------------------------------------------------------------
 def build_agent():
-    g = StateGraph(dict)
-    g.add_node("summarize", summarization_node)
+    from langgraph.graph import StateGraph, START, END
+    from langgraph.graph.message import add_messages
+    from langgraph.prebuilt import ToolNode
+    from langgraph.checkpoint.memory import MemorySaver
+
+    from tools.product_tools import tools  # your existing product tools
+
+    class AgentState(TypedDict, total=False):
+        messages: Annotated[list, add_messages]
+        summarized_messages: list
+        step_count: int
+
+    memory = MemorySaver()
+
+    g = StateGraph(AgentState)
+    g.add_node("summarize", summarize)
     g.add_node("llm_call", llm_call)
+    # in the async graph ToolNode gathers multiple tool_calls from one AIMessage concurrently
+    # (our sync tools run in the default executor), so comparisons don't serialize
     g.add_node("tools", ToolNode(tools))
+    g.add_node("tool_reply", tool_reply)
 
     g.add_edge(START, "summarize")
     g.add_edge("summarize", "llm_call")
     g.add_conditional_edges("llm_call", route, {"tools": "tools", END: END})
-    g.add_edge("tools", "llm_call")
+    g.add_conditional_edges("tools", route_after_tools, {"tool_reply": "tool_reply", "summarize": "summarize"})
+    g.add_edge("tool_reply", END)
 
     return g.compile(checkpointer=memory)
 
 
-agent = build_agent()
+def get_agent():
+    """Compiled agent, built on first use (one per process, so conversation memory is shared)."""
+    global _agent
+    if _agent is None:
+        _agent = build_agent()
+    return _agent
 
 
 # -------------------------------------------------------------------
-# Simple answer function (straight from docs)
+# Simple answer function (straight from docs) — async so concurrent sessions can share one event loop
 # -------------------------------------------------------------------
 
-def answer(thread_id: str, text: str) -> str:
+async def answer(thread_id: str, text: str) -> str:
     cfg = {"configurable": {"thread_id": thread_id}}
     final = ""
 
     hm = HumanMessage(id=str(uuid.uuid4()), content=text)
 
-    # For debugging: collect streamed contents
+    # For debugging: set DEBUG_TOOL_MSGS to prefix the reply with raw tool responses
+    debug_tools = bool(os.getenv("DEBUG_TOOL_MSGS"))
     parts = []
 
-    for event in agent.stream({"messages": [hm]}, config=cfg):
-        for _, payload in event.items():
+    # step_count is checkpointed with the thread, so reset it for every new user turn
+    async for event in get_agent().astream({"messages": [hm], "step_count": 0}, config=cfg):
+        for node, payload in event.items():
+            if node == "summarize" or not payload:
+                continue
             msgs = payload.get("messages", [])
             if not msgs:
                 continue
@@ -138,25 +359,35 @@ def answer(thread_id: str, text: str) -> str:
                 parts.append(last.content)
                 final = "".join(parts).strip()
 
-            # If last contains tool calls (tool call request), you may see ToolMessage responses
-            # If ToolMessage content is JSON string, parse it for nicer display or follow-up
-            if isinstance(last, ToolMessage):
-                try:
-                    parsed = json.loads(last.content)
-                    # optionally convert parsed to human readable string
-                    parts.append(f"[Tool response] {json.dumps(parsed, indent=2)}")
-                except Exception:
-                    # not JSON — just append raw content
-                    parts.append(last.content)
+            if debug_tools and isinstance(last, ToolMessage):
+                parts.append(f"[Tool response] {last.content}\n")
 
     return final
 
 
+async def answer_stream(thread_id: str, text: str):
+    """Yield reply text as the model produces it (for UIs that render incrementally)."""
+    cfg = {"configurable": {"thread_id": thread_id}}
+    hm = HumanMessage(id=str(uuid.uuid4()), content=text)
+
+    async for chunk, metadata in get_agent().astream(
+        {"messages": [hm], "step_count": 0}, config=cfg, stream_mode="messages"
+    ):
+        # only forward reply text (LLM tokens or a direct tool reply); skip summaries and tool-call deltas
+        if metadata.get("langgraph_node") not in ("llm_call", "tool_reply"):
+            continue
+        if isinstance(chunk, AIMessage) and chunk.content and not chunk.tool_calls and not getattr(chunk, "tool_call_chunks", None):
+            yield chunk.content
+
+
 # -------------------------------------------------------------------
 # TEST (unchanged)
 # -------------------------------------------------------------------
 if __name__ == "__main__":
-    tid = "test-thread"
-    print(answer(tid, "I want a smartphone"))
-    print(answer(tid, "4"))
-    print(answer(tid, "under 1000"))
+    async def _demo():
+        tid = "test-thread"
+        print(await answer(tid, "I want a smartphone"))
+        print(await answer(tid, "4"))
+        print(await answer(tid, "under 1000"))
+
+    asyncio.run(_demo())
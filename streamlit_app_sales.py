@@ -1,5 +1,8 @@
 # streamlit_app.py
 import streamlit as st
+import asyncio
+import inspect
+import threading
 import traceback
 import uuid
 
@@ -8,22 +11,93 @@ st.title("🛍️ AI Sales Agent")
 st.caption("Chat-based product recommender with checkout simulation")
 
 # ----------------- import backend chat or answer -----------------
-chat_fn = None
-answer_fn = None
-try:
-    # prefer a chat(memory, user_input) function if present
-    from sales_agent_new import chat as imported_chat
-    chat_fn = imported_chat
-    st.success("✅ sales_agent_new.chat loaded")
-except Exception:
+@st.cache_resource(show_spinner="Loading sales agent...")
+def get_agent():
+    """Import the backend and build its LangGraph agent once per process (after the page skeleton renders)."""
+    chat_fn = None
+    answer_fn = None
+    stream_fn = None
+    error = None
     try:
-        # fallback to answer(...) if chat isn't present
-        from sales_agent_new import answer as imported_answer
-        answer_fn = imported_answer
-        st.success("✅ sales_agent_new.answer loaded (will wrap memory -> prompt)")
+        # prefer a chat(memory, user_input) function if present
+        from sales_agent_new import chat as imported_chat
+        chat_fn = imported_chat
     except Exception:
-        st.error("❌ Failed to import sales_agent_new.chat or sales_agent_new.answer")
-        st.code(traceback.format_exc())
+        try:
+            # fallback to answer(...) if chat isn't present
+            from sales_agent_new import answer as imported_answer
+            answer_fn = imported_answer
+            try:
+                # stream tokens into the UI when the backend supports it
+                from sales_agent_new import answer_stream as imported_stream
+                stream_fn = imported_stream
+            except Exception:
+                stream_fn = None
+            # building the graph pulls in langgraph/langchain_groq; pay that here rather than on the first message
+            from sales_agent_new import get_agent as build_backend_agent
+            build_backend_agent()
+        except Exception:
+            answer_fn = stream_fn = None
+            error = traceback.format_exc()
+    return chat_fn, answer_fn, stream_fn, error
+
+
+chat_fn, answer_fn, stream_fn, import_error = get_agent()
+if chat_fn is not None:
+    st.success("✅ sales_agent_new.chat loaded")
+elif answer_fn is not None:
+    st.success("✅ sales_agent_new.answer loaded (will wrap memory -> prompt)")
+else:
+    st.error("❌ Failed to import sales_agent_new.chat or sales_agent_new.answer")
+    st.code(import_error)
+    # don't keep a failed import cached; retry on the next rerun
+    get_agent.clear()
+
+
+@st.cache_resource
+def _get_event_loop():
+    """One long-lived event loop shared by all sessions, so the backend's cached async clients stay on a live loop."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="agent-event-loop", daemon=True).start()
+    return loop
+
+
+def _resolve(result):
+    """Run coroutine results (async backend) on the shared loop; pass plain values through."""
+    if inspect.iscoroutine(result):
+        return asyncio.run_coroutine_threadsafe(result, _get_event_loop()).result()
+    return result
+
+
+async def _anext(agen):
+    return await agen.__anext__()
+
+
+async def _aclose(agen):
+    await agen.aclose()
+
+
+def _iter_async(agen):
+    """Drive an async generator on the shared loop from Streamlit's synchronous script, yielding each item."""
+    loop = _get_event_loop()
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(_anext(agen), loop).result()
+            except StopAsyncIteration:
+                break
+    finally:
+        asyncio.run_coroutine_threadsafe(_aclose(agen), loop).result()
+
+
+RECENT_RENDERED = 10  # messages rendered as individual chat bubbles
+
+
+def _format_message(role: str, content: str) -> str:
+    """Markdown line for one message in the collapsed history block."""
+    prefix = "**You:**" if role == "user" else "**Agent:**"
+    return f"{prefix} {content}"
+
 
 # ----------------- Session state -----------------
 if "thread_id" not in st.session_state:
@@ -35,16 +109,23 @@ if "memory" not in st.session_state:
     # memory format expected by your chat() implementation: list of "User: ...\nAgent: ..."
     st.session_state.memory = []
 
+show_debug = st.sidebar.toggle("Show debug panel", value=False)
+
 # Clear button
 col1, col2 = st.columns([1, 4])
 with col1:
     if st.button("Clear conversation"):
         st.session_state.messages = []
         st.session_state.memory = []
-        st.experimental_rerun()
+        st.rerun()
 
-# render history in chat UI
-for msg in st.session_state.messages:
+# render history in chat UI: recent messages as chat bubbles, older ones as one collapsed block
+history = st.session_state.messages
+older, recent = history[:-RECENT_RENDERED], history[-RECENT_RENDERED:]
+if older:
+    with st.expander(f"Earlier conversation ({len(older)} messages)"):
+        st.markdown("\n\n".join(_format_message(m["role"], m["content"]) for m in older))
+for msg in recent:
     with st.chat_message(msg["role"]):
         st.markdown(msg["content"])
 
@@ -58,10 +139,19 @@ if user_input:
         st.markdown(user_input)
 
     # Call backend via chat_fn if present (preferred)
+    streamed = False
     try:
         if chat_fn is not None:
             # expected signature: chat(memory=None, user_input=None) -> (response, updated_memory)
             response, updated_memory = chat_fn(memory=st.session_state.memory, user_input=user_input)
+        elif stream_fn is not None:
+            # same prompt template as the answer() fallback, but rendered token by token
+            previous = "\n".join(st.session_state.memory)
+            prompt = f"Previous conversation: {previous}\nlatest query: {user_input}"
+            with st.chat_message("assistant"):
+                response = st.write_stream(_iter_async(stream_fn(st.session_state.thread_id, prompt)))
+            streamed = True
+            updated_memory = st.session_state.memory + [f"User: {user_input}\nAgent: {response}"]
         elif answer_fn is not None:
             # build a prompt from memory and user_input and call answer()
             # memory entries are strings like "User: ...\nAgent: ..."
@@ -71,14 +161,14 @@ if user_input:
             # call answer. Try both common signatures: answer(user_input) or answer(thread_id, user_input)
             try:
                 # try simple call first
-                answer_text = answer_fn(prompt)
+                answer_text = _resolve(answer_fn(prompt))
             except TypeError:
                 # try thread-aware signature
                 try:
-                    answer_text = answer_fn(st.session_state.thread_id, prompt)
+                    answer_text = _resolve(answer_fn(st.session_state.thread_id, prompt))
                 except TypeError:
                     # final attempt: pass only user_input
-                    answer_text = answer_fn(user_input)
+                    answer_text = _resolve(answer_fn(user_input))
             response = answer_text
             # update memory the same way chat() would
             updated_memory = st.session_state.memory + [f"User: {user_input}\nAgent: {response}"]
@@ -102,15 +192,17 @@ if user_input:
     # store results
     st.session_state.memory = updated_memory
     st.session_state.messages.append({"role": "assistant", "content": response})
-    with st.chat_message("assistant"):
-        st.markdown(response)
-
-    # ---- DEBUG: show what was sent to backend ----
-    with st.expander("Debug — prompt/history sent to backend (for troubleshooting)"):
-        st.write("thread_id:", st.session_state.thread_id)
-        st.write("memory (last entries):", st.session_state.memory)
-        # Build the exact prompt string we sent (if using answer_fn fallback)
-        if answer_fn is not None and chat_fn is None:
-            previous = "\n".join(st.session_state.memory)
-            st.write("prompt string sent to answer():")
-            st.code(f"Previous conversation: {previous}\nlatest query: {user_input}")
+    if not streamed:
+        with st.chat_message("assistant"):
+            st.markdown(response)
+
+    # ---- DEBUG: show what was sent to backend (only when toggled on) ----
+    if show_debug:
+        with st.expander("Debug — prompt/history sent to backend (for troubleshooting)"):
+            st.write("thread_id:", st.session_state.thread_id)
+            st.write("memory (last entries):", st.session_state.memory)
+            # Build the exact prompt string we sent (if using answer_fn fallback)
+            if answer_fn is not None and chat_fn is None:
+                previous = "\n".join(st.session_state.memory)
+                st.write("prompt string sent to answer():")
+                st.code(f"Previous conversation: {previous}\nlatest query: {user_input}")
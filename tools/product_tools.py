@@ -11,44 +11,136 @@ Design:
 """
 
 import os
+import json
+import time
+import atexit
 import tempfile
-from typing import Optional, Dict, Any, List, Tuple
+import threading
+from typing import Optional, Dict, Any, List, Tuple, IO
 
+import numpy as np
 import pandas as pd
 from langchain.tools import tool
 
+try:
+    import pyarrow  # noqa: F401  (optional: Arrow-backed strings give vectorized .str ops)
+
+    _STRING_DTYPE = "string[pyarrow]"
+except ImportError:
+    _STRING_DTYPE = "string"
+
 # --- Configuration ---
-PRODUCTS_CSV = os.path.join(os.path.dirname(__file__), "data", "my-fastapi-project\tools\data\product.csv")
+PRODUCTS_CSV = os.path.join(os.path.dirname(__file__), "data", "product.csv")
+if not os.path.isfile(PRODUCTS_CSV):
+    # fail once at import rather than on every tool call
+    raise FileNotFoundError(f"Product database not found at {PRODUCTS_CSV}.")
 NUM_RECS_DEFAULT = 5
+# Required columns and the dtypes the C parser casts them to while reading
+PRODUCT_DTYPES = {
+    "product_id": _STRING_DTYPE,
+    "product_name": _STRING_DTYPE,
+    "product_description": _STRING_DTYPE,
+    "type": _STRING_DTYPE,
+    # kept float64 in the frame so returned records print cleanly; _build_index makes float32 copies
+    "price": "float64",
+    "rating": "float64",
+    "inventory_count": "int32",
+}
+ORDERS_LOG_NAME = "orders.jsonl"  # orders not yet snapshotted into the CSV, kept next to it
+SNAPSHOT_EVERY = 50  # rewrite the CSV after this many orders (and always at exit)
+
+# In-memory catalog cache, invalidated when the CSV's mtime changes. "catalog" is one
+# (csv_path, mtime, df, index) tuple so readers never pair a frame with another load's index.
+# "dirty" counts logged orders applied in memory but not yet snapshotted back to the CSV;
+# on (re)load those orders are replayed from the log, so edits made to the CSV on disk are kept too.
+_DF_CACHE: Dict[str, Any] = {"catalog": None, "dirty": 0}
+# Guards inventory reads-then-decrements; re-entrant so combined tools can hold it across calls.
+_CATALOG_LOCK = threading.RLock()
+_ORDER_LOGS: Dict[str, IO[str]] = {}
 
 # --- Helpers ---
 
 
 def _load_products_df(csv_path: str = PRODUCTS_CSV) -> pd.DataFrame:
     """
-    Load CSV into a DataFrame and ensure numeric columns have correct dtypes.
+    Load CSV into a DataFrame, casting columns to their dtypes while parsing.
 
     Raises:
         FileNotFoundError: if CSV doesn't exist.
         ValueError: if required columns missing or cast fails.
     """
-    df = pd.read_csv(csv_path)
-    required_cols = {"product_id", "product_name", "product_description", "type", "price", "rating", "inventory_count"}
-    if not required_cols.issubset(set(df.columns)):
-        missing = required_cols - set(df.columns)
+    df = pd.read_csv(csv_path, dtype=PRODUCT_DTYPES, engine="c")
+    if not set(PRODUCT_DTYPES).issubset(set(df.columns)):
+        missing = set(PRODUCT_DTYPES) - set(df.columns)
         raise ValueError(f"Missing required columns in CSV: {missing}")
 
-    # Cast numeric columns and normalize string columns
-    df["price"] = pd.to_numeric(df["price"], errors="raise")
-    df["rating"] = pd.to_numeric(df["rating"], errors="raise")
-    df["inventory_count"] = pd.to_numeric(df["inventory_count"], errors="raise").astype(int)
-    df["product_id"] = df["product_id"].astype(str)
-    df["product_name"] = df["product_name"].astype(str)
-    df["product_description"] = df["product_description"].astype(str)
-    df["type"] = df["type"].astype(str)
+    # blank cells parse as <NA>; fill them with "" rather than dropping rows, since this frame is
+    # written back over the CSV (rows without an id are kept out of lookups and results instead)
+    text_cols = ["product_id", "product_name", "product_description", "type"]
+    df[text_cols] = df[text_cols].fillna("")
     return df
 
 
+def _build_index(df: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Precompute column arrays (struct-of-arrays) and an id -> row lookup for the catalog.
+    Array positions match the DataFrame's row positions.
+    """
+    # first row wins for ids that collide case-insensitively, like the original column scan
+    id_to_idx: Dict[str, int] = {}
+    for i, pid in enumerate(df["product_id"]):
+        if pid:
+            id_to_idx.setdefault(pid.upper(), i)
+    # rows with a product_id; only these can be recommended, looked up, or bought
+    has_id = (df["product_id"] != "").to_numpy(bool)
+    return {
+        "prices": df["price"].to_numpy(np.float32),
+        "ratings": df["rating"].to_numpy(np.float32),
+        "inventory": df["inventory_count"].to_numpy(np.int32, copy=True),
+        # lowercased type -> row positions; product types are a small categorical set
+        "type_index": {t: rows[has_id[rows]] for t, rows in df.groupby(df["type"].str.lower()).indices.items()},
+        "has_id": has_id,
+        "name_lower": df["product_name"].str.lower(),
+        "desc_lower": df["product_description"].str.lower(),
+        "id_to_idx": id_to_idx,
+    }
+
+
+def _current_catalog(csv_path: str, mtime: int) -> Optional[Tuple[pd.DataFrame, Dict[str, Any]]]:
+    entry = _DF_CACHE["catalog"]
+    if entry is None or entry[0] != csv_path or entry[1] != mtime:
+        return None
+    return entry[2], entry[3]
+
+
+def _load_catalog(csv_path: str) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """(Re)load the CSV into the cache and re-apply orders logged since the last snapshot."""
+    mtime = os.stat(csv_path).st_mtime_ns
+    df = _load_products_df(csv_path).reset_index(drop=True)
+    index = _build_index(df)
+    replayed = _replay_order_log(df, index, csv_path)
+    _DF_CACHE["catalog"] = (csv_path, mtime, df, index)
+    _DF_CACHE["dirty"] = replayed
+    return df, index
+
+
+def _get_catalog(csv_path: str = PRODUCTS_CSV) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    Return the cached catalog DataFrame and its precomputed arrays (see `_build_index`),
+    reloading only if the CSV changed on disk.
+
+    Raises:
+        FileNotFoundError: if CSV doesn't exist.
+    """
+    mtime = os.stat(csv_path).st_mtime_ns
+    catalog = _current_catalog(csv_path, mtime)
+    if catalog is None:
+        # tool calls may run concurrently: one thread reloads, the others wait and reuse it
+        with _CATALOG_LOCK:
+            catalog = _current_catalog(csv_path, mtime) or _load_catalog(csv_path)
+    return catalog
+
+
 def _save_products_df(df: pd.DataFrame, csv_path: str = PRODUCTS_CSV) -> None:
     """
     Persist DataFrame back to CSV atomically (write to temp then replace).
@@ -61,6 +153,80 @@ def _save_products_df(df: pd.DataFrame, csv_path: str = PRODUCTS_CSV) -> None:
     os.replace(tmpname, csv_path)
 
 
+def _snapshot_catalog() -> None:
+    """Write the in-memory catalog back to its CSV if orders were applied since the last snapshot."""
+    with _CATALOG_LOCK:
+        if not _DF_CACHE["dirty"]:
+            return
+        csv_path, mtime, df, index = _DF_CACHE["catalog"]
+        if os.stat(csv_path).st_mtime_ns != mtime:
+            # the CSV was edited on disk; rebuild from it plus the logged orders instead of overwriting it
+            df, index = _load_catalog(csv_path)
+        _save_products_df(df, csv_path)
+        # everything logged so far is now in the CSV, so start an empty log; a crash between
+        # these two steps replays the logged orders twice
+        _truncate_order_log(csv_path)
+        _DF_CACHE["catalog"] = (csv_path, os.stat(csv_path).st_mtime_ns, df, index)
+        _DF_CACHE["dirty"] = 0
+
+
+def _order_log_path(csv_path: str) -> str:
+    return os.path.join(os.path.dirname(csv_path), ORDERS_LOG_NAME)
+
+
+def _append_order_log(entry: Dict[str, Any], csv_path: str) -> None:
+    """Append one order as a JSON line; the log file is opened once per CSV and kept open."""
+    log = _ORDER_LOGS.get(csv_path)
+    if log is None:
+        log = _ORDER_LOGS[csv_path] = open(_order_log_path(csv_path), "a", encoding="utf-8")
+    log.write(json.dumps(entry) + "\n")
+    log.flush()
+
+
+def _truncate_order_log(csv_path: str) -> None:
+    """Empty the order log after a snapshot, so replay cost and file size stay bounded by SNAPSHOT_EVERY."""
+    log = _ORDER_LOGS.pop(csv_path, None)
+    if log is not None:
+        log.close()
+    _ORDER_LOGS[csv_path] = open(_order_log_path(csv_path), "w", encoding="utf-8")
+
+
+def _replay_order_log(df: pd.DataFrame, index: Dict[str, Any], csv_path: str) -> int:
+    """
+    Apply orders logged since the last snapshot to a freshly loaded catalog.
+    Returns the number of orders replayed.
+    """
+    log_path = _order_log_path(csv_path)
+    if not os.path.exists(log_path):
+        return 0
+    pending: List[Dict[str, Any]] = []
+    with open(log_path, encoding="utf-8") as fh:
+        for line in fh:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # torn last line from a crash mid-write
+                continue
+            pending.append(entry)
+
+    for entry in pending:
+        i = index["id_to_idx"].get(str(entry.get("product_id", "")).upper())
+        if i is None:
+            continue
+        remaining = max(int(index["inventory"][i]) - int(entry.get("qty", 0)), 0)
+        df.at[i, "inventory_count"] = remaining
+        index["inventory"][i] = remaining
+    return len(pending)
+
+
+@atexit.register
+def _shutdown() -> None:
+    _snapshot_catalog()
+    for log in _ORDER_LOGS.values():
+        log.close()
+    _ORDER_LOGS.clear()
+
+
 def _format_product_row(row: pd.Series) -> str:
     return f"{row['product_id']} — {row['product_name']} (${row['price']:.2f}, rating {row['rating']}, type {row['type']})"
 
@@ -68,25 +234,28 @@ def _format_product_row(row: pd.Series) -> str:
 # --- Core (machine-friendly) functions ---
 
 
-def search_product_by_name_internal(product_name: str, csv_path: str = PRODUCTS_CSV) -> Dict[str, Any]:
+def search_product_by_name_internal(
+    product_name: str, top_n: int = NUM_RECS_DEFAULT, csv_path: str = PRODUCTS_CSV
+) -> Dict[str, Any]:
     """
-    Search products by keyword in name or description.
+    Search products by keyword in name or description; at most top_n matches are returned.
     Returns dict:
-      {"success": True, "matches": [ {product_row_dict}, ... ] } or
+      {"success": True, "count": n, "total": total_matches, "matches": [ {product_row_dict}, ... ] } or
       {"success": False, "error": "..."}
     """
-    df = _load_products_df(csv_path)
+    df, index = _get_catalog(csv_path)
     q = product_name.strip().lower()
     if not q:
         return {"success": False, "error": "Empty search query."}
 
+    # plain substring match against the lowercased columns built at load time
     mask = (
-        df["product_name"].str.lower().str.contains(q, na=False)
-        | df["product_description"].str.lower().str.contains(q, na=False)
+        index["name_lower"].str.contains(q, na=False, regex=False)
+        | index["desc_lower"].str.contains(q, na=False, regex=False)
     )
-    matches = df[mask]
-    results = matches.to_dict(orient="records")
-    return {"success": True, "count": len(results), "matches": results}
+    rows = np.flatnonzero(mask.to_numpy() & index["has_id"])
+    results = df.iloc[rows[: max(int(top_n), 0)]].to_dict(orient="records")
+    return {"success": True, "count": len(results), "total": int(rows.size), "matches": results}
 
 
 def filter_products_internal(
@@ -101,27 +270,39 @@ def filter_products_internal(
     Filter products and return top_n recommendations sorted by rating (desc) then price (asc).
     Returns dict with success flag and list of product dicts.
     """
-    df = _load_products_df(csv_path)
-    filtered = df
+    df, index = _get_catalog(csv_path)
+    ratings, prices = index["ratings"], index["prices"]
 
     if product_type:
-        filtered = filtered[filtered["type"].str.lower() == product_type.strip().lower()]
+        rows = index["type_index"].get(product_type.strip().lower(), np.array([], dtype=np.int64))
+    else:
+        rows = np.flatnonzero(index["has_id"])
 
+    # compare in float32 so thresholds like 4.1 match the stored values exactly
     if min_rating is not None:
-        filtered = filtered[filtered["rating"] >= float(min_rating)]
+        rows = rows[ratings[rows] >= np.float32(min_rating)]
 
     if min_price is not None:
-        filtered = filtered[filtered["price"] >= float(min_price)]
+        rows = rows[prices[rows] >= np.float32(min_price)]
 
     if max_price is not None:
-        filtered = filtered[filtered["price"] <= float(max_price)]
+        rows = rows[prices[rows] <= np.float32(max_price)]
 
-    if filtered.empty:
+    top_n = int(top_n)
+    if rows.size == 0 or top_n <= 0:
         return {"success": True, "count": 0, "recommendations": []}
 
-    # Sort by rating desc, price asc
-    sorted_df = filtered.sort_values(by=["rating", "price"], ascending=[False, True])
-    recs = sorted_df.head(int(top_n)).to_dict(orient="records")
+    # Top-N by rating desc, price asc: partition on rating first, keeping every row tied
+    # with the N-th best rating so the price tie-break stays exact, then sort the few survivors.
+    # Blank ratings sort last (like sort_values), so rank them as +inf instead of comparing NaN.
+    rank = np.nan_to_num(-ratings[rows], nan=np.inf)
+    if rows.size > top_n:
+        kth = np.argpartition(rank, top_n - 1)[top_n - 1]
+        keep = rank <= rank[kth]
+        rows, rank = rows[keep], rank[keep]
+    order = np.lexsort((prices[rows], rank))
+    top = rows[order[:top_n]]
+    recs = df.iloc[top].to_dict(orient="records")
     return {"success": True, "count": len(recs), "recommendations": recs}
 
 
@@ -129,56 +310,78 @@ def check_inventory_internal(product_id: str, csv_path: str = PRODUCTS_CSV) -> D
     """
     Returns stock information for product_id.
     """
-    df = _load_products_df(csv_path)
-    mask = df["product_id"].str.upper() == str(product_id).strip().upper()
-    matches = df[mask]
-    if matches.empty:
+    df, index = _get_catalog(csv_path)
+    i = index["id_to_idx"].get(str(product_id).strip().upper())
+    if i is None:
         return {"success": False, "error": "not_found", "product_id": product_id}
-    row = matches.iloc[0]
+    inventory_count = int(index["inventory"][i])
     return {
         "success": True,
-        "product_id": row["product_id"],
-        "product_name": row["product_name"],
-        "price": float(row["price"]),
-        "rating": float(row["rating"]),
-        "inventory_count": int(row["inventory_count"]),
-        "in_stock": int(row["inventory_count"]) > 0,
+        "product_id": df.at[i, "product_id"],
+        "product_name": df.at[i, "product_name"],
+        "price": float(df.at[i, "price"]),
+        "rating": float(df.at[i, "rating"]),
+        "inventory_count": inventory_count,
+        "in_stock": inventory_count > 0,
     }
 
 
 def checkout_internal(product_id: str, quantity: int = 1, csv_path: str = PRODUCTS_CSV) -> Dict[str, Any]:
     """
-    Reduce inventory by `quantity` and persist. Returns dict:
+    Reduce inventory by `quantity` in memory and append the order to the order log. Returns dict:
       {"success": True, "order": {...}} or {"success": False, "error": "..."}
-    Note: This is a simple CSV-backed checkout mechanism (not safe for concurrent writes in production).
+    The CSV itself is rewritten every SNAPSHOT_EVERY orders and at interpreter exit.
     """
     if quantity <= 0:
         return {"success": False, "error": "invalid_quantity", "message": "Quantity must be >= 1"}
 
-    df = _load_products_df(csv_path)
-    mask = df["product_id"].str.upper() == str(product_id).strip().upper()
-    idx = df.index[mask]
-    if len(idx) == 0:
-        return {"success": False, "error": "not_found", "product_id": product_id}
+    with _CATALOG_LOCK:
+        df, index = _get_catalog(csv_path)
+        i = index["id_to_idx"].get(str(product_id).strip().upper())
+        if i is None:
+            return {"success": False, "error": "not_found", "product_id": product_id}
+
+        available = int(index["inventory"][i])
+        if available < quantity:
+            return {"success": False, "error": "insufficient_inventory", "available": available}
+
+        # update the cached frame and arrays in place; the log line makes the order survive a crash
+        # (it is replayed on the next load until a snapshot writes it into the CSV)
+        df.at[i, "inventory_count"] = available - quantity
+        index["inventory"][i] = available - quantity
+
+        unit_price = float(df.at[i, "price"])
+        order = {
+            "order_id": f"ORD-{os.urandom(4).hex()}",
+            "product_id": df.at[i, "product_id"],
+            "product_name": df.at[i, "product_name"],
+            "qty": int(quantity),
+            "unit_price": unit_price,
+            "total_price": round(unit_price * int(quantity), 2),
+        }
+        _append_order_log({**order, "ts": time.time()}, csv_path)
+        _DF_CACHE["dirty"] += 1
+        if _DF_CACHE["dirty"] >= SNAPSHOT_EVERY:
+            _snapshot_catalog()
+    return {"success": True, "order": order}
 
-    i = idx[0]
-    available = int(df.at[i, "inventory_count"])
-    if available < quantity:
-        return {"success": False, "error": "insufficient_inventory", "available": available}
 
-    # perform update and save
-    df.at[i, "inventory_count"] = available - quantity
-    _save_products_df(df, csv_path)
+def confirm_and_checkout_internal(product_id: str, quantity: int = 1, csv_path: str = PRODUCTS_CSV) -> Dict[str, Any]:
+    """
+    Check stock and place the order in one call (used once the user has confirmed). Returns dict:
+      {"success": True, "in_stock": True, "order": {...}} or
+      {"success": False, "in_stock": bool, "error": "..."}
+    """
+    with _CATALOG_LOCK:
+        inventory = check_inventory_internal(product_id, csv_path)
+        if not inventory["success"]:
+            return {"success": False, "in_stock": False, "error": "not_found", "product_id": product_id}
+        if not inventory["in_stock"]:
+            return {"success": False, "in_stock": False, "error": "out_of_stock", "product_id": inventory["product_id"]}
 
-    order = {
-        "order_id": f"ORD-{os.urandom(4).hex()}",
-        "product_id": df.at[i, "product_id"],
-        "product_name": df.at[i, "product_name"],
-        "qty": int(quantity),
-        "unit_price": float(df.at[i, "price"]),
-        "total_price": round(float(df.at[i, "price"]) * int(quantity), 2),
-    }
-    return {"success": True, "order": order}
+        result = checkout_internal(product_id, quantity, csv_path)
+    result["in_stock"] = True
+    return result
 
 
 # --- Tool wrappers (human-friendly strings for LangChain) ---
@@ -189,7 +392,9 @@ def _dict_to_text_search(result: Dict[str, Any]) -> str:
         return f"Error: {result.get('error', 'unknown')}. {result.get('message','')}"
     if result["count"] == 0:
         return "No products found."
-    lines = [f"Products found ({result['count']}):"]
+    total = result.get("total", result["count"])
+    shown = f"{total}, showing {result['count']}" if total > result["count"] else f"{result['count']}"
+    lines = [f"Products found ({shown}):"]
     for r in result["matches"]:
         lines.append(f"• {_format_product_row(pd.Series(r))}")
     return "\n".join(lines)
@@ -231,10 +436,10 @@ def _dict_to_text_checkout(result: Dict[str, Any]) -> str:
 
 
 @tool
-def search_product_by_name(product_name: str) -> str:
-    """Tool wrapper for product search (human-friendly string output)."""
+def search_product_by_name(product_name: str, top_n: int = NUM_RECS_DEFAULT) -> str:
+    """Tool wrapper for product search (human-friendly string output, at most top_n matches)."""
     try:
-        result = search_product_by_name_internal(product_name)
+        result = search_product_by_name_internal(product_name, top_n=top_n)
     except FileNotFoundError:
         return f"Product database not found at {PRODUCTS_CSV}."
     except Exception as exc:
@@ -291,5 +496,17 @@ def checkout_product(product_id: str, quantity: int = 1) -> str:
     return _dict_to_text_checkout(result)
 
 
+@tool
+def confirm_and_checkout_json(product_id: str, quantity: int = 1) -> str:
+    """Check inventory and checkout in one step after the user confirms (JSON output: in_stock, order or error)."""
+    try:
+        result = confirm_and_checkout_internal(product_id, int(quantity))
+    except FileNotFoundError:
+        result = {"success": False, "error": f"Product database not found at {PRODUCTS_CSV}."}
+    except Exception as exc:
+        result = {"success": False, "error": f"Error during checkout: {exc}"}
+    return json.dumps(result)
+
+
 # Export a list for convenience (if your loader expects it)
-tools = [search_product_by_name, filter_products, check_inventory, checkout_product]
+tools = [search_product_by_name, filter_products, check_inventory, checkout_product, confirm_and_checkout_json]